@@ -5,6 +5,27 @@ sudo apt install -y gpsd
 sudo dpkg-reconfigure -plow gpsd
 sudo cp ~/PiFinder/pi_config_files/gpsd.conf /etc/default/gpsd
 
+# Pillow-SIMD, see pifinder_setup.sh.  The requirements install
+# brings stock Pillow back over it, swap it out again
+if sudo pip show pillow > /dev/null 2>&1
+then
+    echo "Installing Pillow-SIMD"
+    sudo apt install -y libjpeg-dev zlib1g-dev python3-dev
+    rm -rf /tmp/pillow-simd
+    if pip wheel --no-deps "pillow-simd<9.6" -w /tmp/pillow-simd
+    then
+        sudo pip uninstall -y pillow
+        if ! sudo pip install --force-reinstall /tmp/pillow-simd/*.whl
+        then
+            echo "Pillow-SIMD install failed, restoring Pillow"
+            sudo pip install "$(grep -i '^pillow==' /home/pifinder/PiFinder/requirements.txt)"
+        fi
+    else
+        echo "Pillow-SIMD build failed, keeping Pillow"
+    fi
+    rm -rf /tmp/pillow-simd
+fi
+
 # PWM
 sudo sed -zi '/dtoverlay=pwm,pin=13,func=4\n/!s/$/\ndtoverlay=pwm,pin=13,func=4\n/' /boot/config.txt
 
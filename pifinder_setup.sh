@@ -5,6 +5,25 @@ git clone --recursive --branch release https://github.com/brickbots/PiFinder.git
 cd PiFinder
 sudo pip install -r requirements.txt
 
+# Pillow-SIMD is a drop in replacement for Pillow with vectorized
+# resize/filter/convert paths which speeds up camera image handling.
+# Both install into PIL/, so stock Pillow has to go first.  It's built
+# from source, only swap if the build worked
+sudo apt-get install -y libjpeg-dev zlib1g-dev python3-dev
+rm -rf /tmp/pillow-simd
+if pip wheel --no-deps "pillow-simd<9.6" -w /tmp/pillow-simd
+then
+    sudo pip uninstall -y pillow
+    if ! sudo pip install /tmp/pillow-simd/*.whl
+    then
+        echo "Pillow-SIMD install failed, restoring Pillow"
+        sudo pip install "$(grep -i '^pillow==' requirements.txt)"
+    fi
+else
+    echo "Pillow-SIMD build failed, keeping Pillow"
+fi
+rm -rf /tmp/pillow-simd
+
 # Setup GPSD
 sudo dpkg-reconfigure -plow gpsd
 sudo cp ~/PiFinder/pi_config_files/gpsd.conf /etc/default/gpsd
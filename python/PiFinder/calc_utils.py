@@ -1,6 +1,7 @@
 import datetime
 import pytz
 import math
+import numpy as np
 from skyfield.api import (
     wgs84,
     Loader,
@@ -39,35 +40,47 @@ class FastAltAz:
 
         self.local_siderial_time = lst % 360
 
+        # observer terms are constant for all objects
+        _lat = np.deg2rad(self.lat)
+        self._sin_lat = np.sin(_lat)
+        self._cos_lat = np.cos(_lat)
+
     def radec_to_altaz(self, ra, dec, alt_only=False):
-        hour_angle = (self.local_siderial_time - ra) % 360
-
-        _alt = math.sin(dec * math.pi / 180) * math.sin(
-            self.lat * math.pi / 180
-        ) + math.cos(dec * math.pi / 180) * math.cos(
-            self.lat * math.pi / 180
-        ) * math.cos(
-            hour_angle * math.pi / 180
-        )
+        """
+        ra/dec in degrees, either scalars or NumPy arrays
+        so whole catalogs can be converted in one call
+        """
+        hour_angle = np.deg2rad((self.local_siderial_time - ra) % 360)
+        _dec = np.deg2rad(dec)
+        sin_dec = np.sin(_dec)
 
-        alt = math.asin(_alt) * 180 / math.pi
+        _alt = sin_dec * self._sin_lat + np.cos(_dec) * self._cos_lat * np.cos(
+            hour_angle
+        )
+        alt = np.rad2deg(np.arcsin(_alt))
         if alt_only:
             return alt
 
-        _az = (
-            math.sin(dec * math.pi / 180)
-            - math.sin(alt * math.pi / 180) * math.sin(self.lat * math.pi / 180)
-        ) / (math.cos(alt * math.pi / 180) * math.cos(self.lat * math.pi / 180))
-
-        _az = math.acos(_az) * 180 / math.pi
+        _alt = np.deg2rad(alt)
+        _az = (sin_dec - np.sin(_alt) * self._sin_lat) / (np.cos(_alt) * self._cos_lat)
+        _az = np.rad2deg(np.arccos(np.clip(_az, -1, 1)))
 
-        if math.sin(hour_angle * math.pi / 180) < 0:
-            az = _az
-        else:
-            az = 360 - _az
+        # [()] unwraps the 0-d result of np.where for scalar input
+        az = np.where(np.sin(hour_angle) < 0, _az, 360 - _az)[()]
         return alt, az
 
 
+def radec_to_xyz(ra, dec):
+    """
+    ra/dec in degrees (scalars or arrays) to unit vectors
+    on the celestial sphere, one row per position
+    """
+    _ra = np.deg2rad(ra)
+    _dec = np.deg2rad(dec)
+    cos_dec = np.cos(_dec)
+    return np.column_stack([cos_dec * np.cos(_ra), cos_dec * np.sin(_ra), np.sin(_dec)])
+
+
 def ra_to_deg(ra_h, ra_m, ra_s):
     ra_deg = ra_h
     if ra_m > 0:
@@ -11,6 +11,8 @@ This module is the camera
 import os
 import queue
 import time
+import logging
+import PIL
 from PIL import Image
 from PiFinder import config
 from PiFinder import utils
@@ -24,6 +26,12 @@ class CameraPI(CameraInterface):
     def __init__(self, exposure_time, gain) -> None:
         from picamera2 import Picamera2
 
+        # Pillow-SIMD tags its releases with a .postN suffix
+        if "post" not in PIL.__version__:
+            logging.info(
+                f"Pillow {PIL.__version__} in use, install pillow-simd for faster image ops"
+            )
+
         self.camera = Picamera2()
         # Figure out camera type, hq or gs (global shutter)
         self.camera_type = "hq"
@@ -36,7 +44,11 @@ class CameraPI(CameraInterface):
         """Initializes the camera and set the needed control parameters"""
         self.camera.stop()
         # using this smaller scale auto-selects binning on the sensor...
-        cam_config = self.camera.create_still_configuration({"size": (512, 512)})
+        # BGR888 is picamera2's name for RGB-ordered pixels, so the
+        # array can be handed straight to PIL without a channel swap
+        cam_config = self.camera.create_still_configuration(
+            main={"size": (512, 512), "format": "BGR888"}, buffer_count=2
+        )
         self.camera.configure(cam_config)
         self.camera.set_controls({"AeEnable": False})
         self.camera.set_controls({"AnalogueGain": self.gain})
@@ -44,7 +56,7 @@ class CameraPI(CameraInterface):
         self.camera.start()
 
     def capture(self) -> Image.Image:
-        return self.camera.capture_image()
+        return Image.fromarray(self.camera.capture_array("main"))
 
     def capture_file(self, filename) -> None:
         return self.camera.capture_file(filename)
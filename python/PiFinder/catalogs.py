@@ -2,11 +2,13 @@ import logging
 import time
 import datetime
 import pytz
-from typing import List, Dict, DefaultDict, Optional
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Sequence, Set, Tuple
 import numpy as np
 import pandas as pd
 from collections import defaultdict
-from sklearn.neighbors import BallTree
+from operator import attrgetter
+from scipy.spatial import cKDTree
 
 import PiFinder.calc_utils as calc_utils
 from PiFinder.db.db import Database
@@ -32,7 +34,7 @@ class Names:
     """
 
     db: Database
-    names: DefaultDict[int, List[str]] = {}
+    names: Dict[int, List[str]]
 
     def __init__(self):
         self.db = ObjectsDatabase()
@@ -46,14 +48,37 @@ class Names:
         """
         pass
 
-    def get(self, object_id) -> List[str]:
-        return self.names[object_id]
+    def get(self, object_id) -> Sequence[str]:
+        # shared empty tuple for objects without names, avoids
+        # the defaultdict inserting a new list for each of them
+        return self.names.get(object_id, ())
+
+
+def mag_to_float(mag) -> float:
+    """
+    Object magnitudes are stored as text, anything
+    that does not parse sorts as very faint
+    """
+    try:
+        return float(mag)
+    except (ValueError, TypeError):
+        return 99
 
 
 class CatalogFilter:
     """can be set on catalog to filter"""
 
-    fast_aa = None
+    __slots__ = (
+        "magnitude_filter",
+        "type_filter",
+        "_type_filter_array",
+        "altitude_filter",
+        "observed_filter",
+        "fast_aa",
+    )
+
+    # seconds an unchanged filter result is reused, altitudes drift slowly
+    refresh_interval = 30
 
     def __init__(
         self,
@@ -62,6 +87,7 @@ class CatalogFilter:
         altitude_filter=None,
         observed_filter=None,
     ):
+        self.fast_aa = None
         self.set_values(magnitude_filter, type_filter, altitude_filter, observed_filter)
 
     def set_values(
@@ -69,9 +95,28 @@ class CatalogFilter:
     ):
         self.magnitude_filter = magnitude_filter
         self.type_filter = type_filter
+        # array for np.isin, built once, None means no type filtering
+        self._type_filter_array = (
+            np.array(type_filter, dtype=object)
+            if type_filter is not None and type_filter != ["None"]
+            else None
+        )
         self.altitude_filter = altitude_filter
         self.observed_filter = observed_filter
 
+    def get_filter_key(self) -> tuple:
+        """
+        Identifies a filter result, changes when any filter value
+        changes or a new refresh interval starts
+        """
+        return (
+            self.magnitude_filter,
+            tuple(self.type_filter or []),
+            self.altitude_filter,
+            self.observed_filter,
+            int(time.time() // self.refresh_interval),
+        )
+
     def calc_fast_aa(self, shared_state):
         solution = shared_state.solution()
         location = shared_state.location()
@@ -83,59 +128,57 @@ class CatalogFilter:
                 dt,
             )
         else:
+            self.fast_aa = None
             logging.warning(
                 f"Calc_fast_aa: {'solution' if not solution else 'location' if not location else 'datetime' if not dt else 'nothing'} not set"
             )
 
-    def apply_filter(self, obj: CompositeObject):
+    def apply(self, shared_state, catalog: "CatalogBase") -> np.ndarray:
+        """
+        Filters all objects of a catalog in one pass over the
+        catalog's column arrays, returns the positions of the
+        objects that pass
+        """
+        self.calc_fast_aa(shared_state)
+        mask = np.ones(catalog.get_count(), dtype=bool)
+
         # check altitude
         if self.altitude_filter != "None" and self.fast_aa:
-            obj_altitude = self.fast_aa.radec_to_altaz(
-                obj.ra,
-                obj.dec,
-                alt_only=True,
+            obj_altitudes = self.fast_aa.radec_to_altaz(
+                catalog._ra, catalog._dec, alt_only=True
             )
-            if obj_altitude < self.altitude_filter:
-                return False
+            mask &= obj_altitudes >= self.altitude_filter
 
         # check magnitude
-
-        # first try to get object mag to float
-        try:
-            obj_mag = float(obj.mag)
-        except (ValueError, TypeError):
-            obj_mag = 99
-
-        if self.magnitude_filter != "None" and obj_mag >= self.magnitude_filter:
-            return False
+        if self.magnitude_filter != "None":
+            mask &= catalog._mag < self.magnitude_filter
 
         # check type
-        if self.type_filter != ["None"] and obj.obj_type not in self.type_filter:
-            return False
+        if self._type_filter_array is not None:
+            mask &= np.isin(catalog._obj_type, self._type_filter_array)
 
         # check observed
         if self.observed_filter != "Any":
-            return (self.observed_filter == "Yes") == obj.logged
-
-        # object passed all the tests
-        return True
+            mask &= catalog._logged == (self.observed_filter == "Yes")
 
-    def apply(self, shared_state, objects: List[CompositeObject]):
-        self.fast_aa = self.calc_fast_aa(shared_state)
-        return [obj for obj in objects if self.apply_filter(obj)]
+        return np.flatnonzero(mask)
 
 
-def catalog_base_id_sort(obj: CompositeObject):
-    return obj.id
-
-
-def catalog_base_sequence_sort(obj: CompositeObject):
-    return obj.sequence
+# sort keys for CatalogBase, attrgetter avoids a python call per object
+catalog_base_id_sort = attrgetter("id")
+catalog_base_sequence_sort = attrgetter("sequence")
 
 
 class CatalogBase:
     """Base class for Catalog, contains only the objects"""
 
+    catalog_code: str
+    max_sequence: int
+    desc: str
+    objects: List[CompositeObject]
+    id_to_pos: Dict[int, int]
+    sequence_to_pos: Dict[int, int]
+
     def __init__(
         self,
         catalog_code: str,
@@ -147,29 +190,44 @@ class CatalogBase:
         self.max_sequence = max_sequence
         self.desc = desc
         self.sort = sort
-        self.objects: List[CompositeObject] = []
-        self.id_to_pos: Dict[int, int]
-        self.sequence_to_pos: Dict[int, int]
-        self.catalog_code: str
-        self.max_sequence: int
-        self.desc: str
-        self.sort = sort
+        self.objects = []
+        self._deferred = False
+        self._rebuild_indices()
 
     def add_object(self, obj: CompositeObject):
         self._add_object(obj)
-        self._sort_objects()
-        self._update_id_to_pos()
-        self._update_sequence_to_pos()
+        if not self._deferred:
+            self._finalize_objects()
 
     def _add_object(self, obj: CompositeObject):
         self.objects.append(obj)
 
     def add_objects(self, objects: List[CompositeObject]):
-        for obj in objects:
-            self._add_object(obj)
+        with self.batch_add():
+            for obj in objects:
+                self._add_object(obj)
+
+    @contextmanager
+    def batch_add(self):
+        """
+        Defers sorting and reindexing until all objects
+        added inside the block are in place
+        """
+        if self._deferred:
+            # already batching, the outer block finalizes
+            yield self
+            return
+
+        self._deferred = True
+        try:
+            yield self
+        finally:
+            self._deferred = False
+            self._finalize_objects()
+
+    def _finalize_objects(self):
         self._sort_objects()
-        self._update_id_to_pos()
-        self._update_sequence_to_pos()
+        self._rebuild_indices()
 
     def _sort_objects(self):
         self.objects.sort(key=self.sort)
@@ -192,11 +250,28 @@ class CatalogBase:
     def get_count(self) -> int:
         return len(self.objects)
 
-    def _update_id_to_pos(self):
-        self.id_to_pos = {obj.id: i for i, obj in enumerate(self.objects)}
-
-    def _update_sequence_to_pos(self):
-        self.sequence_to_pos = {obj.sequence: i for i, obj in enumerate(self.objects)}
+    def _rebuild_indices(self):
+        """
+        Rebuilds the id/sequence => position lookups and the
+        column (structure of arrays) copies of the object fields
+        used for vectorized filtering, in a single pass
+        """
+        count = len(self.objects)
+        self.id_to_pos = {}
+        self.sequence_to_pos = {}
+        self._ra = np.empty(count, dtype=np.float64)
+        self._dec = np.empty(count, dtype=np.float64)
+        self._mag = np.empty(count, dtype=np.float64)
+        self._obj_type = np.empty(count, dtype=object)
+        self._logged = np.empty(count, dtype=bool)
+        for i, obj in enumerate(self.objects):
+            self.id_to_pos[obj.id] = i
+            self.sequence_to_pos[obj.sequence] = i
+            self._ra[i] = obj.ra
+            self._dec[i] = obj.dec
+            self._mag[i] = mag_to_float(obj.mag)
+            self._obj_type[i] = obj.obj_type
+            self._logged[i] = obj.logged
 
     def __repr__(self):
         return f"Catalog({self.catalog_code=}, {self.max_sequence=}, count={self.get_count()})"
@@ -211,21 +286,70 @@ class Catalog(CatalogBase):
     def __init__(self, catalog_code: str, max_sequence: int, desc: str):
         super().__init__(catalog_code, max_sequence, desc)
         self.catalog_filter: CatalogFilter = CatalogFilter()
-        self.filtered_objects: List[CompositeObject] = self.get_objects()
-        self.filtered_objects_seq: List[int] = self._filtered_objects_to_seq()
+        self._set_filtered(np.arange(self.get_count()))
         self.last_filtered = 0
+        self._last_filter_key: Optional[tuple] = None
 
-    def _filtered_objects_to_seq(self):
-        return [obj.sequence for obj in self.filtered_objects]
+    def _finalize_objects(self):
+        super()._finalize_objects()
+        # positions have moved, show all objects until filtered again
+        self._set_filtered(np.arange(self.get_count()))
+        self._last_filter_key = None
 
-    def filter_objects(self, shared_state) -> List[CompositeObject]:
-        self.filtered_objects = self.catalog_filter.apply(
-            shared_state, self.get_objects()
+    def _set_filtered(self, filtered_pos: np.ndarray):
+        """
+        Sets the filtered objects from their positions in
+        self.objects, along with everything derived from them
+        """
+        self.filtered_objects: List[CompositeObject] = [
+            self.objects[i] for i in filtered_pos
+        ]
+        # unit vectors of the filtered objects for nearest object searches
+        self._filtered_xyz = calc_utils.radec_to_xyz(
+            self._ra[filtered_pos], self._dec[filtered_pos]
         )
-        self.filtered_objects_seq = self._filtered_objects_to_seq()
+        self._kd_cache: Optional[cKDTree] = None
+        self._update_filtered_seq()
+
+    def _update_filtered_seq(self):
+        """
+        Sequence list and sequence => position lookup
+        for the filtered objects
+        """
+        self.filtered_objects_seq: List[int] = [
+            obj.sequence for obj in self.filtered_objects
+        ]
+        self.filtered_seq_to_pos: Dict[int, int] = {
+            seq: i for i, seq in enumerate(self.filtered_objects_seq)
+        }
+
+    def filter_objects(self, shared_state) -> List[CompositeObject]:
+        filter_key = self.catalog_filter.get_filter_key()
+        if filter_key == self._last_filter_key:
+            return self.filtered_objects
+
+        self._set_filtered(self.catalog_filter.apply(shared_state, self))
         self.last_filtered = time.time()
+        if (
+            self.catalog_filter.altitude_filter != "None"
+            and self.catalog_filter.fast_aa is None
+        ):
+            # altitude was skipped for lack of a solve/location, don't
+            # reuse this result once altitudes can be computed
+            self._last_filter_key = None
+        else:
+            self._last_filter_key = filter_key
         return self.filtered_objects
 
+    def get_filtered_kdtree(self) -> Optional[cKDTree]:
+        """
+        KD tree over the unit vectors of the filtered objects,
+        built on first use after each filter pass
+        """
+        if self._kd_cache is None and self.filtered_objects:
+            self._kd_cache = cKDTree(self._filtered_xyz)
+        return self._kd_cache
+
     # move this code to the filter class?
     def get_filtered_count(self):
         return len(self.filtered_objects)
@@ -243,34 +367,30 @@ class Catalogs:
 
     def __init__(self, catalogs: List[Catalog]):
         self.catalogs: List[Catalog] = catalogs
-        self._code_to_pos: Dict[str, int] = {}
+        self.__refresh_code_to_pos()
 
     def set(self, catalogs: List[Catalog]):
         self.catalogs = catalogs
-        self._code_to_pos = {}
+        self.__refresh_code_to_pos()
 
     def add(self, catalog: Catalog):
-        self.__refresh_code_to_pos()
         if catalog.catalog_code not in self._code_to_pos:
             self.catalogs.append(catalog)
-            self._code_to_pos = {}
+            self.__refresh_code_to_pos()
         else:
             logging.warning(f"Catalog {catalog.catalog_code} already exists")
 
     def remove(self, catalog_code: str):
-        self.__refresh_code_to_pos()
         if catalog_code in self._code_to_pos:
             self.catalogs.pop(self._code_to_pos[catalog_code])
-            self._code_to_pos = {}
+            self.__refresh_code_to_pos()
         else:
-            logging.warning(f"Catalog {catalog.catalog_code} does not exist")
+            logging.warning(f"Catalog {catalog_code} does not exist")
 
     def get_codes(self) -> List[str]:
-        self.__refresh_code_to_pos()
-        return list(self._code_to_pos.keys())
+        return self._codes
 
     def get_catalog_by_code(self, catalog_code: str) -> Optional[Catalog]:
-        self.__refresh_code_to_pos()
         if catalog_code in self._code_to_pos:
             return self.catalogs[self._code_to_pos[catalog_code]]
         else:
@@ -283,20 +403,20 @@ class Catalogs:
             return None
 
     def get_catalog_pos_by_code(self, catalog_code: str) -> Optional[int]:
-        self.__refresh_code_to_pos()
-        if catalog_code in self._code_to_pos:
-            return self._code_to_pos[catalog_code]
-        else:
-            return None
+        return self._code_to_pos.get(catalog_code)
 
     def count(self) -> int:
         return len(self.catalogs)
 
-    def __refresh_code_to_pos(self, force=False):
-        if not self._code_to_pos or force:
-            self._code_to_pos = {
-                catalog.catalog_code: idx for idx, catalog in enumerate(self.catalogs)
-            }
+    def __refresh_code_to_pos(self):
+        """
+        Rebuilds the code lookup, called whenever
+        the list of catalogs changes
+        """
+        self._code_to_pos: Dict[str, int] = {
+            catalog.catalog_code: idx for idx, catalog in enumerate(self.catalogs)
+        }
+        self._codes: List[str] = list(self._code_to_pos.keys())
 
     def __repr__(self):
         return f"Catalogs({self.catalogs=})"
@@ -315,10 +435,11 @@ class PlanetCatalog(Catalog):
         super().__init__("PL", 10, "The planets")
         planet_dict = sf_utils.calc_planets(dt)
         sequence = 0
-        for name in sf_utils.planet_names:
-            if name.lower() != "sun":
-                self.add_planet(sequence, name, planet_dict[name])
-                sequence += 1
+        with self.batch_add():
+            for name in sf_utils.planet_names:
+                if name.lower() != "sun":
+                    self.add_planet(sequence, name, planet_dict[name])
+                    sequence += 1
 
     def add_planet(self, sequence: int, name: str, planet: Dict[str, Dict[str, float]]):
         ra, dec = planet["radec"]
@@ -350,15 +471,16 @@ class CatalogBuilder:
 
     def build(self) -> Catalogs:
         db: Database = ObjectsDatabase()
-        obs_db: Database = ObservationsDatabase()
+        obs_db: ObservationsDatabase = ObservationsDatabase()
         # list of dicts, one dict for each entry in the catalog_objects table
         catalog_objects: List[Dict] = [dict(row) for row in db.get_catalog_objects()]
         objects = db.get_objects()
         common_names = Names()
         catalogs_info = db.get_catalogs_dict()
         objects = {row["id"]: dict(row) for row in objects}
+        logged_ids = obs_db.get_all_logged_ids()
         composite_objects: List[CompositeObject] = self._build_composite(
-            catalog_objects, objects, common_names, obs_db
+            catalog_objects, objects, common_names, logged_ids
         )
         # This is used for caching catalog dicts
         # to speed up repeated searches
@@ -379,19 +501,21 @@ class CatalogBuilder:
         catalog_objects: List[Dict],
         objects: Dict[int, Dict],
         common_names: Names,
-        obs_db: ObservationsDatabase,
+        logged_ids: Set[Tuple[str, int]],
     ) -> List[CompositeObject]:
         composite_objects: List[CompositeObject] = []
 
         for catalog_obj in catalog_objects:
             object_id = catalog_obj["object_id"]
 
-            # Merge the two dictionaries
-            composite_data = objects[object_id] | catalog_obj
-
-            # Create an instance from the merged dictionaries
-            composite_instance = CompositeObject.from_dict(composite_data)
-            composite_instance.logged = obs_db.check_logged(composite_instance)
+            # Create an instance from both dictionaries
+            composite_instance = CompositeObject.from_two_dicts(
+                objects[object_id], catalog_obj
+            )
+            composite_instance.logged = (
+                composite_instance.catalog_code,
+                composite_instance.sequence,
+            ) in logged_ids
             composite_instance.names = common_names.get(object_id)
 
             # Append to the result dictionary
@@ -425,6 +549,8 @@ class CatalogDesignator:
     """Holds the string that represents the catalog input/search field.
     Usually looks like 'NGC----' or 'M-13'"""
 
+    __slots__ = ("catalog_name", "object_number", "width", "field", "catalog_index")
+
     def __init__(self, catalog_name: str, max_sequence: int):
         self.catalog_name = catalog_name
         self.object_number = 0
@@ -496,7 +622,7 @@ class CatalogTracker:
             c.catalog_code: CatalogDesignator(c.catalog_code, c.max_sequence)
             for c in self.catalogs.catalogs
         }
-        print("designator tracker", self.designator_tracker)
+        logging.debug(f"designator tracker {self.designator_tracker}")
         catalog_codes = self.catalogs.get_codes()
         self.set_current_catalog(catalog_codes[0])
         self.object_tracker = {c: None for c in catalog_codes}
@@ -504,13 +630,13 @@ class CatalogTracker:
     def add_foreign_catalog(self, catalog_name):
         """foreign objects not in our database, e.g. skysafari coords"""
         ui_state = self.shared_state.ui_state()
-        print(f"adding foreign catalog {catalog_name}")
-        print(f"current catalog names: {self.catalogs.get_codes()}")
-        print(f"current catalog name: {self.current_catalog_name}")
-        print(f"current catalog: {self.current_catalog}")
-        print(f"current object: {self.get_current_object()}")
-        print(f"current designator: {self.get_designator()}")
-        print(f"ui state: {str(ui_state)}")
+        logging.debug(f"adding foreign catalog {catalog_name}")
+        logging.debug(f"current catalog names: {self.catalogs.get_codes()}")
+        logging.debug(f"current catalog name: {self.current_catalog_name}")
+        logging.debug(f"current catalog: {self.current_catalog}")
+        logging.debug(f"current object: {self.get_current_object()}")
+        logging.debug(f"current designator: {self.get_designator()}")
+        logging.debug(f"ui state: {str(ui_state)}")
         push_catalog = Catalog("PUSH", 1, "Skysafari push")
         target = ui_state.target()
         push_catalog.add_object(
@@ -532,13 +658,15 @@ class CatalogTracker:
         self.object_tracker[catalog_name] = None
 
     def set_current_catalog(self, catalog_name: str):
-        if catalog_name not in self.catalogs.get_codes():
+        current_catalog = self.catalogs.get_catalog_by_code(catalog_name)
+        if current_catalog is None:
             self.add_foreign_catalog(catalog_name)
+            current_catalog = self.catalogs.get_catalog_by_code(catalog_name)
 
         assert (
-            catalog_name in self.catalogs.get_codes()
-        ), f"{catalog_name} not in {self.catalogs.get_codes}"
-        self.current_catalog: Catalog = self.catalogs.get_catalog_by_code(catalog_name)
+            current_catalog is not None
+        ), f"{catalog_name} not in {self.catalogs.get_codes()}"
+        self.current_catalog: Catalog = current_catalog
         self.current_catalog_name = catalog_name
 
     def next_catalog(self, direction=1):
@@ -558,29 +686,28 @@ class CatalogTracker:
         direction: 1 for next, -1 for previous
 
         """
-        objects = (
-            self.current_catalog.filtered_objects
-            if filtered
-            else self.current_catalog.get_objects()
-        )
-        object_ids = [x.sequence for x in objects]
+        if filtered:
+            objects = self.current_catalog.filtered_objects
+            sequence_to_pos = self.current_catalog.filtered_seq_to_pos
+        else:
+            objects = self.current_catalog.get_objects()
+            sequence_to_pos = self.current_catalog.sequence_to_pos
         current_key = self.object_tracker[self.current_catalog_name]
         next_key = None
         designator = self.get_designator()
         # there is no current object, so set the first object the first or last
-        if current_key is None or current_key not in object_ids:
-            next_index = 0 if direction == 1 else len(object_ids) - 1
-            next_key = object_ids[next_index]
+        if current_key is None or current_key not in sequence_to_pos:
+            next_index = 0 if direction == 1 else len(objects) - 1
+            next_key = objects[next_index].sequence
             designator.set_number(next_key)
 
         else:
-            current_index = object_ids.index(current_key)
-            next_index = current_index + direction
-            if next_index == -1 or next_index >= len(object_ids):
+            next_index = sequence_to_pos[current_key] + direction
+            if next_index == -1 or next_index >= len(objects):
                 next_key = None  # hack to get around the fact that 0 is a valid key
                 designator.set_number(0)  # todo use -1 in designator as well
             else:
-                next_key = object_ids[next_index % len(object_ids)]
+                next_key = objects[next_index].sequence
                 designator.set_number(next_key)
         self.set_current_object(next_key)
         return self.get_current_object()
@@ -645,19 +772,30 @@ class CatalogTracker:
         Takes the current catalog or a list of catalogs, gets the filtered
         objects and returns the n closest objects to ra/dec
         """
-        catalog_list: List[Catalog] = catalogs.catalogs
-        catalog_list_flat = [
-            obj for catalog in catalog_list for obj in catalog.filtered_objects
-        ]
-        if len(catalog_list_flat) < n:
-            n = len(catalog_list_flat)
-        object_radecs = [
-            [np.deg2rad(x.ra), np.deg2rad(x.dec)] for x in catalog_list_flat
-        ]
-        objects_bt = BallTree(object_radecs, leaf_size=4, metric="haversine")
-        query = [[np.deg2rad(ra), np.deg2rad(dec)]]
-        _dist, obj_ind = objects_bt.query(query, k=n)
-        results = [catalog_list_flat[x] for x in obj_ind[0]]
+        # chord distance between unit vectors grows with the angular
+        # distance, so the nearest objects are the same
+        query = calc_utils.radec_to_xyz(ra, dec)
+        distances = []
+        candidates: List[CompositeObject] = []
+        for catalog in catalogs.catalogs:
+            objects_kd = catalog.get_filtered_kdtree()
+            if objects_kd is None:
+                continue
+            k = min(n, catalog.get_filtered_count())
+            # k as a list keeps the results 2D, even for k=1
+            _dist, obj_ind = objects_kd.query(query, k=list(range(1, k + 1)))
+            distances.append(_dist[0])
+            candidates.extend(catalog.filtered_objects[x] for x in obj_ind[0])
+
+        if not candidates:
+            return []
+
+        # merge the per catalog nearest objects and keep the n closest
+        distances = np.concatenate(distances)
+        n = min(n, len(candidates))
+        nearest = np.argpartition(distances, n - 1)[:n]
+        nearest = nearest[np.argsort(distances[nearest])]
+        results = [candidates[x] for x in nearest]
         deduplicated = self._deduplicate(results)
         return deduplicated
 
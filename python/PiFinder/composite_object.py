@@ -31,3 +31,25 @@ class CompositeObject:
     @classmethod
     def from_dict(cls, d):
         return cls(**d)
+
+    @classmethod
+    def from_two_dicts(cls, obj_d, cat_d):
+        """
+        Creates an instance from an objects row and a catalog_objects
+        row without merging them first.  Like the merge, the
+        catalog_objects values win for keys present in both (id)
+        """
+        return cls(
+            id=cat_d["id"],
+            object_id=cat_d["object_id"],
+            obj_type=obj_d["obj_type"],
+            ra=obj_d["ra"],
+            dec=obj_d["dec"],
+            const=obj_d["const"],
+            size=obj_d["size"],
+            mag=obj_d["mag"],
+            catalog_code=cat_d["catalog_code"],
+            sequence=cat_d["sequence"],
+            description=cat_d["description"],
+            image_name=obj_d["image_name"],
+        )
@@ -1,6 +1,6 @@
 import json
 from pathlib import Path
-from typing import Tuple
+from typing import Set, Tuple
 from sqlite3 import Connection, Cursor, Error
 from PiFinder.db.db import Database
 import PiFinder.utils as utils
@@ -138,13 +138,18 @@ class ObservationsDatabase(Database):
 
         return logs
 
+    def get_all_logged_ids(self) -> Set[Tuple[str, int]]:
+        """
+        Returns a set of (catalog, sequence) for
+        all observed objects
+        """
+        return {(x["catalog"], x["sequence"]) for x in self.get_observed_objects()}
+
     def load_observed_objects_cache(self):
         """
         (re)Loads the logged object cache
         """
-        self.observed_objects_cache = [
-            (x["catalog"], x["sequence"]) for x in self.get_observed_objects()
-        ]
+        self.observed_objects_cache = self.get_all_logged_ids()
 
     def check_logged(self, obj_record: CompositeObject):
         """
@@ -1,9 +1,13 @@
 import logging
 import io
+import os
+import gzip
+import functools
 import uuid
 import json
 from datetime import datetime, timezone
 import time
+import threading
 from bottle import (
     Bottle,
     run,
@@ -11,12 +15,13 @@ from bottle import (
     template,
     response,
     static_file,
-    debug,
+    SimpleTemplate,
     redirect,
+    HTTPError,
     CherootServer,
 )
 
-from PIL import Image
+from PIL import Image, ImageChops
 
 from PiFinder.keyboard_interface import KeyboardInterface
 
@@ -32,6 +37,40 @@ from PiFinder.db.observations_db import (
 # Generate a secret to validate the auth cookie
 SESSION_SECRET = str(uuid.uuid4())
 
+# Each open /stream holds a web server thread, cap the streams
+# so regular requests always have threads left
+WEB_THREADS = 24
+MAX_STREAMS = 8
+# seconds between repeats of an unchanged frame, a write is the only
+# way to notice a client has gone away
+STREAM_KEEPALIVE = 5
+
+
+BUTTON_DICT = {
+    "UP": KeyboardInterface.UP,
+    "DN": KeyboardInterface.DN,
+    "ENT": KeyboardInterface.ENT,
+    "A": KeyboardInterface.A,
+    "B": KeyboardInterface.B,
+    "C": KeyboardInterface.C,
+    "D": KeyboardInterface.D,
+    "ALT_UP": KeyboardInterface.ALT_UP,
+    "ALT_DN": KeyboardInterface.ALT_DN,
+    "ALT_A": KeyboardInterface.ALT_A,
+    "ALT_B": KeyboardInterface.ALT_B,
+    "ALT_C": KeyboardInterface.ALT_C,
+    "ALT_D": KeyboardInterface.ALT_D,
+    "ALT_0": KeyboardInterface.ALT_0,
+    "LNG_A": KeyboardInterface.LNG_A,
+    "LNG_B": KeyboardInterface.LNG_B,
+    "LNG_C": KeyboardInterface.LNG_C,
+    "LNG_D": KeyboardInterface.LNG_D,
+    "LNG_ENT": KeyboardInterface.LNG_ENT,
+}
+# remote buttons send either a key name or a digit, map both
+# straight to the keycode
+KEY_MAP = {**BUTTON_DICT, **{str(i): i for i in range(10)}}
+
 
 def auth_required(func):
     def auth_wrapper(*args, **kwargs):
@@ -45,69 +84,201 @@ def auth_required(func):
     return auth_wrapper
 
 
+def static_file_cached(filename, root, **kwargs):
+    """
+    static_file with long lived browser caching, asset urls
+    carry the software version so upgrades are picked up
+    """
+    resp = static_file(filename, root=root, **kwargs)
+    if resp.status_code < 400:
+        resp.set_header("Cache-Control", "public, max-age=86400, immutable")
+    return resp
+
+
+def static_file_chunked(filename, root, chunk_size=1024 * 1024, **kwargs):
+    """
+    static_file for large downloads.  Cheroot has no
+    wsgi.file_wrapper, so bottle would read the file in
+    64k pieces, use larger reads instead
+    """
+    resp = static_file(filename, root=root, **kwargs)
+    fp = resp.body
+    # range and HEAD requests don't come back as a file
+    if hasattr(fp, "read"):
+
+        def file_chunks():
+            with fp:
+                chunk = fp.read(chunk_size)
+                while chunk:
+                    yield chunk
+                    chunk = fp.read(chunk_size)
+
+        resp.body = file_chunks()
+    return resp
+
+
+@functools.lru_cache(maxsize=16)
+def gzip_body(body: bytes) -> bytes:
+    """
+    Most pages render the same every time, so keep
+    recent compressed bodies around
+    """
+    return gzip.compress(body, compresslevel=1)
+
+
+def gzip_html(callback):
+    """
+    Bottle plugin, gzips rendered pages for clients that
+    accept it.  The PiFinder's own wifi AP is often slow
+    so fewer bytes matter more than the cpu
+    """
+
+    def wrapper(*args, **kwargs):
+        body = callback(*args, **kwargs)
+        # bottle only fills in its text/html default on output
+        content_type = response.content_type or "text/html"
+        if isinstance(body, str) and content_type.startswith("text/html"):
+            response.set_header("Vary", "Accept-Encoding")
+            if "gzip" in request.get_header("Accept-Encoding", ""):
+                response.set_header("Content-Encoding", "gzip")
+                return gzip_body(body.encode(response.charset))
+        return body
+
+    return wrapper
+
+
+# One palette per colour channel, ramping from black to full
+# intensity in that channel
+CHANNEL_PALETTES = [
+    bytes(v for i in range(256) for v in (i, 0, 0)),
+    bytes(v for i in range(256) for v in (0, i, 0)),
+    bytes(v for i in range(256) for v in (0, 0, i)),
+]
+
+
+def palettize_screen(img):
+    """
+    The UI draws in shades of a single colour, see
+    image_util.Colors.  Store such screens as one 8 bit
+    band, a third of the data for the PNG encoder.
+    Lossless, anything else is returned unchanged
+    """
+    if img.mode != "RGB":
+        return img
+    bands = img.split()
+    empty = [band.getbbox() is None for band in bands]
+    for i, band in enumerate(bands):
+        if all(empty[:i] + empty[i + 1 :]):
+            band.putpalette(CHANNEL_PALETTES[i])
+            return band
+    if (
+        ImageChops.difference(bands[0], bands[1]).getbbox() is None
+        and ImageChops.difference(bands[0], bands[2]).getbbox() is None
+    ):
+        # grey display
+        return bands[0]
+    return img
+
+
 class Server:
     def __init__(self, q, gps_queue, shared_state, is_debug=False):
         self.version_txt = f"{utils.pifinder_dir}/version.txt"
         self.q = q
         self.gps_queue = gps_queue
         self.shared_state = shared_state
-        self.ki = KeyboardInterface()
         # gps info
         self.lat = None
         self.lon = None
         self.altitude = None
         self.gps_locked = False
+        self._status = None
+        self._status_time = 0.0
+        # (screen hash, encoded png) of the latest screen, replaced as
+        # a whole so readers never see a mismatched pair
+        self._last_png = (None, b"")
+        # placeholder served before the UI has published a screen,
+        # encoded once up front
+        empty_img = Image.new("RGB", (60, 30), color=(73, 109, 137))
+        img_byte_arr = io.BytesIO()
+        empty_img.save(img_byte_arr, format="PNG")
+        self._empty_png = (0, img_byte_arr.getvalue())
+        # screen encoding runs in the background while clients poll /image
+        self._last_screen_request = 0.0
+        self._screen_wanted = threading.Event()
+        self._screen_updated = threading.Condition()
+        self._encode_lock = threading.Lock()
+        self._stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+        threading.Thread(target=self._screen_encoder_loop, daemon=True).start()
 
         logger = logging.getLogger()
         if is_debug:
             logger.setLevel(logging.DEBUG)
 
-        button_dict = {
-            "UP": self.ki.UP,
-            "DN": self.ki.DN,
-            "ENT": self.ki.ENT,
-            "A": self.ki.A,
-            "B": self.ki.B,
-            "C": self.ki.C,
-            "D": self.ki.D,
-            "ALT_UP": self.ki.ALT_UP,
-            "ALT_DN": self.ki.ALT_DN,
-            "ALT_A": self.ki.ALT_A,
-            "ALT_B": self.ki.ALT_B,
-            "ALT_C": self.ki.ALT_C,
-            "ALT_D": self.ki.ALT_D,
-            "ALT_0": self.ki.ALT_0,
-            "LNG_A": self.ki.LNG_A,
-            "LNG_B": self.ki.LNG_B,
-            "LNG_C": self.ki.LNG_C,
-            "LNG_D": self.ki.LNG_D,
-            "LNG_ENT": self.ki.LNG_ENT,
-        }
-
         self.network = sys_utils.Network()
 
+        # version only changes with an upgrade, which restarts the server
+        with open(self.version_txt, "r") as ver_f:
+            self.software_version = ver_f.read()
+        # available to all templates for versioning static asset urls
+        SimpleTemplate.defaults["asset_version"] = self.software_version.strip()
+        # pages use it to spot a stalled screen stream
+        SimpleTemplate.defaults["stream_keepalive"] = STREAM_KEEPALIVE
+
         app = Bottle()
-        debug(True)
+        app.install(gzip_html)
+        self._register_routes(app)
+
+        # If the PiFinder software is running as a service
+        # it can grab port 80.  If not, it needs to use 8080
+        try:
+            run(
+                app,
+                host="0.0.0.0",
+                port=80,
+                quiet=True,
+                debug=is_debug,
+                server=CherootServer,
+                numthreads=WEB_THREADS,
+            )
+        except (PermissionError, OSError):
+            logging.info("Web Interface on port 8080")
+            run(
+                app,
+                host="0.0.0.0",
+                port=8080,
+                quiet=True,
+                debug=is_debug,
+                server=CherootServer,
+                numthreads=WEB_THREADS,
+            )
 
-        @app.route(r"/images/<filename:re:.*\.png>")
+    def _register_routes(self, app):
+        """
+        Adds the web interface routes to app, the handlers
+        are closures over this server
+        """
+
+        @app.route("/images/<filename>")
         def send_image(filename):
-            return static_file(filename, root="views/images", mimetype="image/png")
+            # plain wildcard route, cheaper to match than a regex
+            if not filename.endswith(".png"):
+                return HTTPError(404, "File does not exist.")
+            return static_file_cached(
+                filename, root="views/images", mimetype="image/png"
+            )
 
         @app.route("/js/<filename>")
-        def send_static(filename):
-            return static_file(filename, root="views/js")
+        def send_js(filename):
+            return static_file_cached(filename, root="views/js")
 
         @app.route("/css/<filename>")
-        def send_static(filename):
-            return static_file(filename, root="views/css")
+        def send_css(filename):
+            return static_file_cached(filename, root="views/css")
 
         @app.route("/")
         def home():
             logging.debug("/ called")
             # need to collect alittle status info here
-            with open(self.version_txt, "r") as ver_f:
-                software_version = ver_f.read()
-
             self.update_gps()
             lat_text = ""
             lon_text = ""
@@ -122,19 +293,22 @@ class Server:
             ra_text = "0"
             dec_text = "0"
             camera_icon = "broken_image"
-            if self.shared_state.solve_state() is True:
+            status = self._get_status()
+            if status["solve_state"] is True:
                 camera_icon = "camera_alt"
-                solution = self.shared_state.solution()
+                solution = status["solution"]
                 hh, mm, _ = calc_utils.ra_to_hms(solution["RA"])
-                ra_text = f"{hh:02.0f}h{mm:02.0f}m"
+                # ra_to_hms returns whole hours and minutes
+                ra_text = "%02dh%02dm" % (int(hh), int(mm))
                 dec_text = f"{solution['Dec']: .2f}"
 
+            network_info = self.network.snapshot()
             return template(
                 "index",
-                software_version=software_version,
-                wifi_mode=self.network.wifi_mode(),
-                ip=self.network.local_ip(),
-                network_name=self.network.get_connected_ssid(),
+                software_version=self.software_version,
+                wifi_mode=network_info["mode"],
+                ip=network_info["ip"],
+                network_name=network_info["ssid"],
                 gps_icon=gps_icon,
                 gps_text=gps_text,
                 lat_text=lat_text,
@@ -219,7 +393,7 @@ class Server:
 
         @app.route("/network/add", method="post")
         @auth_required
-        def network_update():
+        def network_add():
             ssid = request.forms.get("ssid")
             psk = request.forms.get("psk")
             if len(psk) < 8:
@@ -282,7 +456,7 @@ class Server:
 
         @app.route("/system/restart_pifinder")
         @auth_required
-        def system_restart():
+        def pifinder_restart():
             """
             Restarts just the PiFinder software
             """
@@ -349,12 +523,13 @@ class Server:
         def tools_backup():
             backup_file = sys_utils.backup_userdata()
 
-            # Assumes the standard backup location
-            return static_file("PiFinder_backup.zip", "/home/pifinder/PiFinder_data")
+            return static_file_chunked(
+                os.path.basename(backup_file), os.path.dirname(backup_file)
+            )
 
         @app.route("/tools/restore", method="post")
         @auth_required
-        def tools_backup():
+        def tools_restore():
             sys_utils.remove_backup()
             backup_file = request.files.get("backup_file")
             backup_file.filename = "PiFinder_backup.zip"
@@ -370,31 +545,62 @@ class Server:
         @auth_required
         def key_callback():
             button = request.json.get("button")
-            if button in button_dict:
-                self.key_callback(button_dict[button])
-            else:
-                self.key_callback(int(button))
+            key = KEY_MAP.get(button)
+            if key is None:
+                key = int(button)
+            self.key_callback(key)
             return {"message": "success"}
 
         @app.route("/image")
         def serve_pil_image():
-            empty_img = Image.new(
-                "RGB", (60, 30), color=(73, 109, 137)
-            )  # create an image using PIL
-            img = None
-            try:
-                img = self.shared_state.screen()
-            except (BrokenPipeError, EOFError):
-                pass
+            self._request_screen()
+            screen_key, screen_png = self._last_png
             response.content_type = "image/png"  # adjust for your image format
+            etag = f'"{screen_key & 0xFFFFFFFFFFFFFFFF:x}"'
+            response.set_header("Cache-Control", "no-cache")
+            response.set_header("ETag", etag)
+            if request.get_header("If-None-Match") == etag:
+                response.status = 304
+                return ""
 
-            if img is None:
-                img = empty_img
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format="PNG")  # adjust for your image format
-            img_byte_arr = img_byte_arr.getvalue()
+            return screen_png
 
-            return img_byte_arr
+        @app.route("/stream")
+        def stream_screen():
+            """
+            Streams the screen as a multipart/x-mixed-replace
+            response, sending a new frame when it changes and
+            repeating the last one every STREAM_KEEPALIVE seconds
+            """
+            if not self._stream_slots.acquire(blocking=False):
+                return HTTPError(503, "Too many screen streams open.")
+            response.content_type = "multipart/x-mixed-replace; boundary=frame"
+
+            def frames():
+                try:
+                    last_key = None
+                    last_sent = 0.0
+                    while True:
+                        self._request_screen()
+                        screen_key, screen_png = self._last_png
+                        now = time.monotonic()
+                        if screen_key != last_key or now - last_sent > STREAM_KEEPALIVE:
+                            last_key = screen_key
+                            last_sent = now
+                            yield (
+                                b"--frame\r\nContent-Type: image/png\r\n"
+                                b"Content-Length: %d\r\n\r\n" % len(screen_png)
+                                + screen_png
+                                + b"\r\n"
+                            )
+                        with self._screen_updated:
+                            self._screen_updated.wait(timeout=1)
+                finally:
+                    # closed by the server once a write to a gone
+                    # client fails
+                    self._stream_slots.release()
+
+            return frames()
 
         @auth_required
         def gps_lock(lat: float = 50, lon: float = 3, altitude: float = 10):
@@ -415,33 +621,90 @@ class Server:
             self.gps_queue.put(msg)
             logging.debug("Putting time msg on gps_queue: {msg}")
 
-        # If the PiFinder software is running as a service
-        # it can grab port 80.  If not, it needs to use 8080
+    def _encode_screen(self):
+        """
+        Encodes the current screen to PNG if it has
+        changed since the last encode.  Call with
+        _encode_lock held
+        """
+        img = None
         try:
-            run(
-                app,
-                host="0.0.0.0",
-                port=80,
-                quiet=True,
-                debug=True,
-                server=CherootServer,
-            )
-        except (PermissionError, OSError):
-            logging.info("Web Interface on port 8080")
-            run(
-                app,
-                host="0.0.0.0",
-                port=8080,
-                quiet=True,
-                debug=True,
-                server=CherootServer,
-            )
+            img = self.shared_state.screen()
+        except (BrokenPipeError, EOFError):
+            pass
+
+        if img is None:
+            if self._last_png[0] != self._empty_png[0]:
+                self._last_png = self._empty_png
+                with self._screen_updated:
+                    self._screen_updated.notify_all()
+            return
+
+        # The UI republishes the screen every frame, mostly unchanged,
+        # so only encode when the pixels differ
+        screen_key = hash(img.tobytes())
+        if screen_key != self._last_png[0]:
+            img_byte_arr = io.BytesIO()
+            # the screen is tiny and polled often, favour encode
+            # speed over size
+            palettize_screen(img).save(img_byte_arr, format="PNG", compress_level=1)
+            self._last_png = (screen_key, img_byte_arr.getvalue())
+            with self._screen_updated:
+                self._screen_updated.notify_all()
+
+    def _request_screen(self):
+        """
+        Marks the screen as wanted by a web client, keeping
+        the encoder thread running
+        """
+        self._last_screen_request = time.monotonic()
+        if not self._screen_wanted.is_set():
+            with self._encode_lock:
+                # concurrent requests wait here for the first one
+                # to encode, rather than each encoding the frame
+                if not self._screen_wanted.is_set():
+                    # encoder thread is idle, bring the frame up to date first
+                    self._encode_screen()
+                    self._screen_wanted.set()
+
+    def _screen_encoder_loop(self):
+        """
+        Keeps the encoded screen current while web clients
+        are polling /image, then idles until the next request
+        """
+        while True:
+            self._screen_wanted.wait()
+            with self._encode_lock:
+                if time.monotonic() - self._last_screen_request > 5:
+                    self._screen_wanted.clear()
+                    continue
+                try:
+                    self._encode_screen()
+                except Exception:
+                    logging.exception("Screen encode failed")
+                    # go idle, the next request encodes inline and
+                    # restarts the loop
+                    self._screen_wanted.clear()
+                    continue
+            time.sleep(0.1)
 
     def key_callback(self, key):
         self.q.put(key)
 
+    def _get_status(self):
+        """
+        Shared state status for the web pages, cached briefly
+        as each shared state call is a round trip to the
+        manager process
+        """
+        now = time.monotonic()
+        if self._status is None or now - self._status_time > 0.5:
+            self._status = self.shared_state.status()
+            self._status_time = now
+        return self._status
+
     def update_gps(self):
-        location = self.shared_state.location()
+        location = self._get_status()["location"]
         if location["gps_lock"] is True:
             self.gps_locked = True
             self.lat = location["lat"]
@@ -193,6 +193,17 @@ class SharedStateObj:
     def set_location(self, v):
         self.__location = v
 
+    def status(self):
+        """
+        Location, solve state and solution in one call,
+        saves proxy round trips for other processes
+        """
+        return {
+            "location": self.__location,
+            "solve_state": self.__solve_state,
+            "solution": self.__solution,
+        }
+
     def last_image_metadata(self):
         return self.__last_image_metadata
 
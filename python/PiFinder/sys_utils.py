@@ -1,4 +1,5 @@
 import glob
+import time
 import sh
 from sh import wpa_cli, unzip, su, passwd
 import socket
@@ -17,6 +18,8 @@ class Network:
         with open(self.wifi_txt, "r") as wifi_f:
             self._wifi_mode = wifi_f.read()
 
+        self._snapshot = None
+        self._snapshot_time = 0.0
         self.populate_wifi_networks()
 
     def populate_wifi_networks(self):
@@ -165,6 +168,22 @@ class Network:
             s.close()
         return ip
 
+    def snapshot(self):
+        """
+        Returns the wifi mode, local ip and connected ssid
+        in one dict.  Cached for a couple of seconds as the
+        ssid lookup spawns a subprocess
+        """
+        now = time.monotonic()
+        if self._snapshot is None or now - self._snapshot_time > 2:
+            self._snapshot = {
+                "mode": self.wifi_mode(),
+                "ip": self.local_ip(),
+                "ssid": self.get_connected_ssid(),
+            }
+            self._snapshot_time = now
+        return self._snapshot
+
 
 def remove_backup():
     """
@@ -65,6 +65,13 @@ class Network:
     def local_ip(self):
         return "NONE"
 
+    def snapshot(self):
+        return {
+            "mode": self.wifi_mode(),
+            "ip": self.local_ip(),
+            "ssid": self.get_connected_ssid(),
+        }
+
 
 def remove_backup():
     """
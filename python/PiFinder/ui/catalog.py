@@ -156,7 +156,7 @@ class UICatalog(UIModule):
         if (
             current_designator.has_number()
             and current_designator.object_number
-            not in self.catalog_tracker.current_catalog.filtered_objects_seq
+            not in self.catalog_tracker.current_catalog.filtered_seq_to_pos
         ):
             designator_color = 128
         return self.simpleTextLayout(
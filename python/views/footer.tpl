@@ -15,9 +15,9 @@
 
 
   <!--  Scripts-->
-  <script src="/js/jquery-2.1.1.min.js"></script>
-  <script src="/js/materialize.js"></script>
-  <script src="/js/init.js"></script>
+  <script src="/js/jquery-2.1.1.min.js?v={{asset_version}}"></script>
+  <script src="/js/materialize.js?v={{asset_version}}"></script>
+  <script src="/js/init.js?v={{asset_version}}"></script>
 
   </body>
 </html>
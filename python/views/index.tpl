@@ -38,34 +38,88 @@
 </table>
 </center>
 <script>
-function fetchImage() {
+function findHeaderEnd(buffer) {
+    // position of the blank line ending a part's headers, or -1
+    for (let i = 0; i + 3 < buffer.length; i++) {
+        if (buffer[i] === 13 && buffer[i + 1] === 10 && buffer[i + 2] === 13 && buffer[i + 3] === 10) {
+            return i;
+        }
+    }
+    return -1;
+}
+
+function startStream() {
+    // The server pushes a new frame down this one connection whenever
+    // the screen changes, and repeats the last one every
+    // {{stream_keepalive}} seconds so a dead connection can be spotted
     const imageElement = document.getElementById('image');
-    fetch("/image?t=" + new Date().getTime())
-        .then(response => {
+    const errorElement = document.getElementById('error');
+    const controller = new AbortController();
+    let watchdog = null;
+    let stopped = false;
+
+    function restart() {
+        if (stopped) { return; }
+        stopped = true;
+        clearTimeout(watchdog);
+        controller.abort();
+        // When the stream can't be fetched or stalls, display a static message
+        // and try to reconnect after a second
+        errorElement.innerHTML = "PiFinder server is currently unavailable. Please try again later.";
+        setTimeout(startStream, 1000);
+    }
+
+    function feedWatchdog() {
+        // no frame for two keepalive periods means the connection is gone
+        clearTimeout(watchdog);
+        watchdog = setTimeout(restart, {{stream_keepalive}} * 2000);
+    }
+
+    function showFrame(png) {
+        const oldURL = imageElement.src;
+        imageElement.src = URL.createObjectURL(new Blob([png], { type: "image/png" }));
+        if (oldURL.startsWith("blob:")) { URL.revokeObjectURL(oldURL); }
+        errorElement.innerHTML = "";
+        feedWatchdog();
+    }
+
+    feedWatchdog();
+    fetch("/stream?t=" + new Date().getTime(), { signal: controller.signal })
+        .then(async response => {
             if (!response.ok) { throw Error(response.statusText); }
-            return response.blob();
-        })
-        .then(imageBlob => {
-            let imageObjectURL = URL.createObjectURL(imageBlob);
-            imageElement.src = imageObjectURL;
-            // When the image can't be fetched, display a static message
-            const errorElement = document.getElementById('error');
-            errorElement.innerHTML = "";
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = new Uint8Array(0);
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) { throw Error("Stream closed"); }
+                const joined = new Uint8Array(buffer.length + value.length);
+                joined.set(buffer);
+                joined.set(value, buffer.length);
+                buffer = joined;
+                // split off every complete part received so far
+                while (true) {
+                    const headerEnd = findHeaderEnd(buffer);
+                    if (headerEnd < 0) { break; }
+                    const headers = decoder.decode(buffer.subarray(0, headerEnd));
+                    const length = headers.match(/Content-Length: (\d+)/i);
+                    if (!length) { throw Error("Bad stream part"); }
+                    const start = headerEnd + 4;
+                    const end = start + parseInt(length[1]);
+                    if (buffer.length < end + 2) { break; }
+                    showFrame(buffer.slice(start, end));
+                    buffer = buffer.slice(end + 2);
+                }
+            }
         })
         .catch(error => {
             console.log(error);
-            // When the image can't be fetched, display a static message
-            const errorElement = document.getElementById('error');
-            errorElement.innerHTML = "PiFinder server is currently unavailable. Please try again later.";
-        })
-        .finally(() => {
-            // Schedule the next fetch operation after 100 milliseconds, whether this operation was successful or not
-            setTimeout(fetchImage, 500);
+            restart();
         });
 }
 
-// Start the first fetch operation
-fetchImage();
+// Start the screen stream
+startStream();
 
 </script>
 